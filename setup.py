@@ -22,6 +22,7 @@ setup(
         "wheel",
         "setuptools_scm"
     ],
+    extras_require={"numpy": ["numpy"]},
     python_requires='>=3.6',
     long_description=LONG_DESCRIPTION,
     long_description_content_type="text/markdown",
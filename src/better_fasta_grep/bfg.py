@@ -9,19 +9,53 @@ headers and or sequences. Default behaviour: look for the provided patterns
 only within headers and output both headers and sequences.
 '''
 
-import argparse
-import io
-import select
 import sys
-import re
 import os
 
+# Modules that are only needed by some modes (argparse, re, select and any
+# optional engines) are imported within the functions that use them, so that
+# short invocations do not pay for them at startup.
+
 VERSION_NUMBER = 0.1
 NORMAL = '\033[0m'
 BOLD_RED = '\033[1;31m'
 GREEN = '\033[32m'
 CYAN = '\033[36m'
+MAGENTA = '\033[35m'
 OFFSET = len(BOLD_RED) + len(NORMAL)
+# Amount of sequence data, in characters, that is matched at a time
+BATCH_SIZE = 1024 * 1024
+# Smallest batch, in records, for which the NumPy engine is worth loading
+VECTORIZE_MIN_RECORDS = 1000
+# Record table columns, as (name, array typecode) pairs: the offset of each
+# header, the offset of its sequence, the sequence length, the width of the
+# first sequence line and the line number of the header
+TABLE_COLUMNS = (('header_offsets', 'Q'), ('sequence_offsets', 'Q'),
+                 ('lengths', 'Q'), ('widths', 'I'), ('line_numbers', 'Q'))
+# Start of a saved record table; tables are stored in native byte order
+TABLE_MAGIC = b'BFGTABLE1' + sys.byteorder[0].encode()
+# Search modes that a query in a --queries file may use
+QUERY_MODES = ('headers', 'sequences', 'records')
+# Number of strings a pattern plan matches between reorderings
+REORDER_INTERVAL = 4096
+# Header fields: the sequence identifier, which runs from the greater than
+# sign to the first whitespace, KEY=VALUE pairs, as used by UniProt (OS=, OX=,
+# GN=), and bracketed [KEY=VALUE] or [organism] fields, as used by NCBI. A KEY
+# starts with an ASCII letter, is followed by letters, digits or underscores,
+# and either starts the header or follows whitespace
+# Whether each field name that was looked up can be such a KEY
+HEADER_KEY_NAMES = {}
+# Value of every command line argument that is not given, see parse_args
+DEFAULT_ARGUMENTS = {
+    'fixed_strings': False, 'file': None, 'ignore_case': False,
+    'search_sequences': False, 'search_records': False, 'field': None,
+    'key': None, 'queries': None, 'all_patterns': False,
+    'invert_match': False, 'max_count': None, 'line_number': False,
+    'count': False, 'no_color': False, 'output_headers': False,
+    'output_sequences': False, 'sort_by': None, 'sample': None, 'seed': None,
+    'record_table': None, 'output_dir': None, 'pattern': None,
+    'fasta_file': None,
+}
 
 
 def supports_color():
@@ -45,7 +79,7 @@ def lines_in_fasta(file):
     Takes the path to a FASTA file as an input. Yields each line within the
     provided file, without newline characters removed, as strings.
     '''
-    if isinstance(file, io.TextIOWrapper):
+    if hasattr(file, 'readline'):
         # input comes from stdin, not file
         for line in file:
             yield line.rstrip()
@@ -60,13 +94,66 @@ def is_header(line):
     return line.startswith('>')
 
 
-def is_hit(result, invert_match=False):
+def sequence_records(file, include_empty=False):
+    '''
+    Takes the path to a FASTA file and a Boolean as an input. Yields each
+    record that contains sequence data, or every record with a header if
+    include_empty is set, as a 3-tuple, where the first item is the header (a
+    2-tuple of line number and line), the second item is a list of the
+    record's sequence lines and the third item is the sequence data, joined
+    into a single string. Lines before the first header are not part of any
+    record.
+    '''
+    line_number = 0
+    current_header = ()
+    sequence_lines = []
+
+    for line in lines_in_fasta(file):
+        if is_header(line):
+            line_number += len(sequence_lines) + 1
+            sequence_data = ''.join(sequence_lines)
+            if current_header and (sequence_data or include_empty):
+                yield current_header, sequence_lines, sequence_data
+            current_header = (line_number, line)
+            sequence_lines = []
+        else:
+            sequence_lines.append(line)
+
+    sequence_data = ''.join(sequence_lines)
+    if current_header and (sequence_data or include_empty):
+        yield current_header, sequence_lines, sequence_data
+
+
+def record_linebreaks(header, sequence_lines):
     '''
-    Takes a regular expression match object and a Boolean as an input. Returns
-    True if the the result is a hit and the search is not inverted or if the
-    result is a miss but the search is inverted, else False.
+    Takes a header (a 2-tuple of line number and line) and a list of sequence
+    lines, as yielded by sequence_records, as an input. Returns a list of
+    2-tuple (line number, line length) linebreaks for the sequence lines.
     '''
-    return (invert_match and not result) or (not invert_match and result)
+    first_line_number = header[0] + 1 if header else 1
+    return [(line_number, len(line)) for line_number, line
+            in enumerate(sequence_lines, first_line_number)]
+
+
+def batched_records(records, batch_size=BATCH_SIZE):
+    '''
+    Takes an iterable of sequence records, as yielded by sequence_records, and
+    the maximum amount of sequence data per batch as an input. Yields lists of
+    records whose combined sequence length is roughly batch_size.
+    '''
+    batch = []
+    batch_length = 0
+
+    for record in records:
+        batch.append(record)
+        batch_length += len(record[2])
+        if batch_length >= batch_size:
+            yield batch
+            batch = []
+            batch_length = 0
+
+    if batch:
+        yield batch
 
 
 def highlight_str(string, span):
@@ -89,6 +176,8 @@ def add_pattern(string, ignore_case=False, fixed_strings=False):
     Takes a string and a Boolean as an input. Returns the string as a regular
     expression Pattern object with re.IGNORECASE set if ignore_case is True.
     '''
+    import re
+
     if fixed_strings:
         string = re.escape(string)
 
@@ -97,15 +186,177 @@ def add_pattern(string, ignore_case=False, fixed_strings=False):
     return re.compile(string)
 
 
+def literal_prefix(pattern):
+    '''
+    Takes a regular expression Pattern object as an input. Returns a 2-tuple
+    where the first item is a literal string that every match of the pattern
+    starts with (possibly empty) and the second item is a Boolean which is True
+    if the pattern consists of nothing but that literal.
+    '''
+    import re
+
+    string = pattern.pattern
+    if pattern.flags & ~(re.IGNORECASE | re.UNICODE) or '|' in string:
+        # an alternation may match without the prefix
+        return '', False
+    if re.escape(string) == string:
+        # no special characters, e.g. a plain sequence motif
+        return string, True
+
+    prefix = []
+    index = 0
+
+    while index < len(string):
+        char = string[index]
+        step = 1
+        if char == '\\':
+            if index + 1 == len(string) or string[index + 1].isalnum():
+                break
+            char = string[index + 1]
+            step = 2
+        elif char in '.^$*+?{}[]()':
+            break
+
+        if string[index + step:index + step + 1] in ('*', '?', '{'):
+            # the character may be absent from a match
+            break
+
+        prefix.append(char)
+        index += step
+
+    return ''.join(prefix), index == len(string)
+
+
+def pattern_cost(step):
+    '''
+    Takes a pattern plan step, a list of pattern, literal, a Boolean which is
+    True if the pattern is just the literal, and a hit count, as an input.
+    Returns a sort key that orders plain literals first, then patterns with a
+    literal prefilter, longest literal first, and then the remaining
+    patterns, shortest first.
+    '''
+    pattern, literal, exact, _ = step
+    return not exact, not literal, -len(literal), len(pattern.pattern)
+
+
+class PatternPlan:
+    '''
+    An ordered collection of unique regular expression Pattern objects.
+    Iterating over a plan yields the patterns in the order they are tried.
+    Each pattern is paired with the literal that its matches start with, so
+    that a plain substring search can rule the pattern out, and patterns that
+    are nothing but a literal never reach the regular expression engine.
+    Patterns are first ordered by estimated cost (see pattern_cost) and are
+    later reordered by how often they match.
+    '''
+
+    def __init__(self, patterns=()):
+        self.steps = []
+        self.keys = set()
+        self.evaluations = 0
+        self.ordered = True
+
+        for pattern in patterns:
+            self.add(pattern)
+
+    def __iter__(self):
+        if not self.ordered:
+            self.reorder()
+        return (step[0] for step in self.steps)
+
+    def __len__(self):
+        return len(self.steps)
+
+    def add(self, pattern):
+        '''
+        Takes a regular expression Pattern object as an input. Adds the
+        pattern to the plan, unless an equivalent pattern is already present.
+        The plan is sorted once, before it is next used, so that adding many
+        patterns stays linear.
+        '''
+        import re
+
+        literal, exact = literal_prefix(pattern)
+        ignore_case = pattern.flags & re.IGNORECASE
+
+        # exact literals and regular expressions are keyed apart, since e.g.
+        # the literal A.B (from A\.B) and the expression A.B are not the same
+        if exact and ignore_case:
+            key = 'literal', pattern.flags, literal.lower()
+        elif exact:
+            key = 'literal', pattern.flags, literal
+        else:
+            key = 'regex', pattern.flags, pattern.pattern
+
+        if key in self.keys:
+            return
+        self.keys.add(key)
+
+        if ignore_case:
+            # a case-sensitive substring search would miss some matches
+            literal, exact = '', False
+        self.steps.append([pattern, literal, exact, 0])
+        self.ordered = False
+
+    def reorder(self, match_all=False):
+        '''
+        Takes a Boolean as an input. Sorts the patterns by how often they
+        matched so far: most often first, so that the first hit comes early,
+        or, if match_all is set, least often first, so that the first miss
+        comes early. Ties keep their estimated cost order.
+        '''
+        sign = 1 if match_all else -1
+        self.steps.sort(key=lambda step: (sign * step[3], pattern_cost(step)))
+        self.ordered = True
+
+    def matches(self, strings, match_all=False, cache=None):
+        '''
+        Takes a sequence of strings, a Boolean and an optional dictionary as an
+        input. Returns True if any pattern (or, if match_all is set, every
+        pattern) is found within any of the strings. Stops at the first
+        pattern that decides the outcome. If a cache is given, whether each
+        pattern is found is looked up in and stored in the cache, so that
+        plans that share patterns only search the same strings once.
+        '''
+        self.evaluations += 1
+        if not self.ordered or self.evaluations % REORDER_INTERVAL == 0:
+            self.reorder(match_all)
+
+        for step in self.steps:
+            pattern, literal, exact, _ = step
+
+            if cache is None or pattern not in cache:
+                found = False
+                for string in strings:
+                    if literal in string and (exact or pattern.search(string)):
+                        found = True
+                        break
+                if cache is not None:
+                    cache[pattern] = found
+            else:
+                found = cache[pattern]
+
+            if not found:
+                if match_all:
+                    return False
+                continue
+
+            step[3] += 1
+            if not match_all:
+                return True
+
+        return match_all
+
+
 def get_patterns(pattern=False, patterns_file=False, ignore_case=False,
                  fixed_strings=False):
     '''
     Takes a string, the path to a file containing multiple patterns, separated
     by newline, and 2 Boolean as an input. The string and the file path is
-    optional. Returns a set of all the patterns that were found in the pattern
-    string and or the patterns file.
+    optional. Returns a PatternPlan of all the unique patterns that were found
+    in the pattern string and or the patterns file.
     '''
-    patterns = set()
+    patterns = PatternPlan()
 
     if pattern:
         patterns.add(add_pattern(pattern, ignore_case, fixed_strings))
@@ -159,54 +410,593 @@ def merge_overlapping_spans(spans):
     return sorted(merged_spans)
 
 
-def searchiter(patterns, string, invert_match=False, color=False):
+def match_patterns(patterns, *strings, invert_match=False,
+                   match_all=False, cache=None):
     '''
-    Takes a set of regular expression pattern objects, a string and 2 Booleans
-    as an input. If color is not set or the matching is inverted: search for
-    the first match and a Boolean and the input string. If color is set,
-    highlight each matching group in the string and return a Boolean and the
-    highlighted string.
+    Takes a PatternPlan and one or more strings as an input. A pattern is
+    found if it matches any of the strings. Returns True if any pattern is
+    found or, if match_all is set, if every pattern is found. If invert_match
+    is set, return the opposite. See PatternPlan.matches for the cache.
+    '''
+    if not patterns.steps:
+        # checked directly, as len() of a plan is a method call per string
+        return False
+    return patterns.matches(strings, match_all, cache) != invert_match
+
+
+def pattern_spans(patterns, string):
+    '''
+    Takes a PatternPlan and a string as an input. Returns a sorted list of
+    non-overlapping 2-tuple spans covering every match of every pattern within
+    the string.
     '''
-    pattern_found = False
-    pattern_found_in_record = False
     spans = set()
 
     for pattern in patterns:
-        pattern_found = is_hit(pattern.search(string), invert_match)
+        for result in pattern.finditer(string):
+            spans.add(result.span())
 
-        if not pattern_found:
-            continue
+    return merge_overlapping_spans(spans)
+
+
+def highlight_spans(string, spans):
+    '''
+    Takes a string and a sorted list of non-overlapping 2-tuple spans as an
+    input. Returns the string with each span highlighted. Spans are applied
+    from the end so that the inserted escape sequences do not shift the
+    spans that are yet to be applied.
+    '''
+    for span in reversed(spans):
+        string = highlight_str(string, span)
+    return string
 
-        if not pattern_found_in_record:
-            pattern_found_in_record = True
 
-        if color and not invert_match:
-            for result in pattern.finditer(string):
-                spans.add(result.span())
-        elif not color or invert_match:
+def searchiter(patterns, string, invert_match=False, color=False,
+               match_all=False):
+    '''
+    Takes a PatternPlan, a string and 3 Booleans as an input. Returns a
+    Boolean, which is True if the string is selected (see match_patterns), and
+    the input string. If color is set and the matching is not inverted, each
+    match in the returned string is highlighted.
+    '''
+    pattern_found = match_patterns(patterns, string, invert_match=invert_match,
+                                   match_all=match_all)
+
+    if pattern_found and color and not invert_match:
+        string = highlight_spans(string, pattern_spans(patterns, string))
+
+    return pattern_found, string
+
+
+def load_numpy():
+    'Returns the numpy module, or None if NumPy is not installed.'
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+def parse_char_class(string, start, ignore_case=False):
+    '''
+    Takes a regular expression string, the index just after an opening
+    bracket and a Boolean as an input. Returns a 2-tuple of the set of codes
+    matched by the character class and the index just after the closing
+    bracket, or None if the class uses any syntax beyond characters, ranges
+    and negation.
+    '''
+    negate = string.startswith('^', start)
+    index = start + negate
+    chars = []
+
+    while index < len(string):
+        char = string[index]
+        if char == ']' and chars:
             break
+        if char == '\\':
+            # an escaped hyphen would be mistaken for a range below
+            index += 1
+            if index == len(string) or string[index].isalnum() or \
+                    string[index] == '-':
+                return None
+            char = string[index]
+        elif char == '[':
+            return None
+        chars.append(char)
+        index += 1
+    else:
+        return None
+
+    codes = set()
+    position = 0
+    while position < len(chars):
+        if position + 2 < len(chars) and chars[position + 1] == '-':
+            first, last = ord(chars[position]), ord(chars[position + 2])
+            if first > last:
+                return None
+            codes.update(range(first, last + 1))
+            position += 3
+        else:
+            codes.add(ord(chars[position]))
+            position += 1
+
+    if ignore_case:
+        codes |= {ord(chr(code).swapcase()) for code in codes}
+    if negate:
+        codes = set(range(128)) - codes
+    return codes, index + 1
 
-    if color and spans:
-        for span in merge_overlapping_spans(spans):
-            string = highlight_str(string, span)
 
-    return pattern_found_in_record, string
+def parse_min_repeat(string, start):
+    '''
+    Takes a regular expression string and the index just after an atom as an
+    input. Returns a 3-tuple of the minimum number of times the atom must
+    repeat for a match, a Boolean which is True if the atom repeats exactly
+    that many times and the index after the quantifier, or None if the
+    quantifier allows the atom to be absent or is unsupported.
+    '''
+    if start == len(string):
+        return 1, True, start
+
+    char = string[start]
+    if char == '+':
+        return 1, False, start + 1
+    if char in '*?':
+        return None
+    if char != '{':
+        return 1, True, start
+
+    end = string.find('}', start)
+    if end < 0:
+        return None
+
+    bounds = string[start + 1:end].split(',')
+    if len(bounds) > 2 or not bounds[0].isdigit():
+        return None
+    if len(bounds) == 2 and bounds[1] and not bounds[1].isdigit():
+        return None
+    if int(bounds[0]) < 1:
+        return None
+    fixed = len(bounds) == 1 or bounds[1] and int(bounds[1]) == int(bounds[0])
+    return int(bounds[0]), fixed, end + 1
+
+
+def simple_pattern_atoms(pattern):
+    '''
+    Takes a regular expression Pattern object as an input. If the pattern is a
+    plain run of literal characters, character classes and dots, each with an
+    optional `+` or `{n}`, `{n,}` or `{n,m}` quantifier, return a list of
+    2-tuples (set of ASCII codes, minimum repeat). Else, return None. Only the
+    first and the last atom may repeat a variable number of times: a match of
+    the pattern then contains a match where those atoms repeat their minimum
+    number of times, which is not true for the atoms in between.
+    '''
+    import re
+
+    if pattern.flags & ~(re.IGNORECASE | re.UNICODE):
+        return None
+
+    string = pattern.pattern
+    if any(ord(char) > 127 for char in string):
+        return None
+
+    ignore_case = bool(pattern.flags & re.IGNORECASE)
+    atoms = []
+    variable = []
+    index = 0
+
+    while index < len(string):
+        char = string[index]
+        if char == '[':
+            parsed = parse_char_class(string, index + 1, ignore_case)
+            if not parsed:
+                return None
+            codes, index = parsed
+        elif char == '.':
+            codes = set(range(128)) - {ord('\n')}
+            index += 1
+        elif char in '^$*+?{}()|]':
+            return None
+        else:
+            if char == '\\':
+                index += 1
+                if index == len(string) or string[index].isalnum():
+                    return None
+                char = string[index]
+            codes = {ord(char)}
+            if ignore_case:
+                codes.add(ord(char.swapcase()))
+            index += 1
+
+        repeat = parse_min_repeat(string, index)
+        if not repeat:
+            return None
+        min_repeat, fixed, index = repeat
+        if not fixed:
+            variable.append(len(atoms))
+        atoms.append((frozenset(codes), min_repeat))
+
+    if any(0 < position < len(atoms) - 1 for position in variable):
+        return None
+    return atoms or None
+
+
+def charset_mask(numpy, codes, charset):
+    '''
+    Takes the numpy module, a uint8 array and a set of ASCII codes as an
+    input. Returns a Boolean array which is True where the array holds one of
+    the codes. The NUL separator never matches.
+    '''
+    excluded = set(range(1, 128)) - charset
+
+    if len(charset) <= 4:
+        mask = numpy.zeros(len(codes), dtype=bool)
+        for code in charset - {0}:
+            mask |= codes == code
+    elif len(excluded) <= 4:
+        mask = codes != 0
+        for code in excluded:
+            mask &= codes != code
+    else:
+        table = numpy.zeros(256, dtype=bool)
+        table[list(charset - {0})] = True
+        mask = table[codes]
+    return mask
 
 
-def count_header_matches(patterns, file, invert_match=False, max_count=None):
+def run_mask(mask, length):
     '''
-    Takes a set of a patterns, the path to a FASTA file, a Boolean and the
+    Takes a Boolean array and a run length as an input. Returns a Boolean
+    array, length - 1 items shorter than the input, which is True at each
+    position that starts a run of at least length True values. Runs are
+    found by repeatedly combining the array with shifted copies of itself,
+    doubling the covered window each time.
+    '''
+    run = mask
+    window = 1
+
+    while window * 2 <= length:
+        run = run[:-window] & run[window:]
+        window *= 2
+
+    if window < length:
+        shift = length - window
+        run = run[:-shift] & run[shift:]
+    return run
+
+
+def vectorized_matches(patterns, sequences, invert_match=False,
+                       match_all=False):
+    '''
+    Takes a PatternPlan, a list of sequences and 2 Booleans as an input.
+    Encodes all sequences into a single uint8 array and evaluates the patterns
+    across them with vectorized comparisons and shifted window combinations.
+    Returns a list of Booleans, one per sequence, which are True where the
+    sequence is selected (see match_patterns). Returns None if NumPy is not
+    available, the batch is too small to benefit, or any pattern or sequence
+    can not be handled by this engine.
+    '''
+    if len(sequences) < VECTORIZE_MIN_RECORDS:
+        return None
+
+    pattern_atoms = [simple_pattern_atoms(pattern) for pattern in patterns]
+    if not pattern_atoms or None in pattern_atoms:
+        return None
+
+    numpy = load_numpy()
+    if numpy is None:
+        return None
+
+    # each sequence is followed by a NUL separator, which no atom may match,
+    # so that matches can not span two sequences
+    try:
+        data = ('\0'.join(sequences) + '\0').encode('ascii')
+    except UnicodeEncodeError:
+        return None
+
+    padding = max(sum(repeat for _, repeat in atoms)
+                  for atoms in pattern_atoms)
+    codes = numpy.frombuffer(data + b'\0' * padding, dtype=numpy.uint8)
+    ends = numpy.flatnonzero(codes[:len(data)] == 0)
+    if len(ends) != len(sequences):
+        # a sequence contains a NUL character
+        return None
+
+    starts = numpy.concatenate(([0], ends[:-1] + 1))
+    masks = {}
+    selected = numpy.full(len(sequences), match_all, dtype=bool)
+
+    for atoms in pattern_atoms:
+        if match_all and not selected.any() or \
+                not match_all and selected.all():
+            # the outcome of every sequence is already decided
+            break
+
+        hits = numpy.ones(len(data), dtype=bool)
+        offset = 0
+
+        for charset, min_repeat in atoms:
+            if charset not in masks:
+                masks[charset] = charset_mask(numpy, codes, charset)
+            run = run_mask(masks[charset], min_repeat)
+            hits &= run[offset:offset + len(data)]
+            offset += min_repeat
+
+        found = numpy.logical_or.reduceat(hits, starts)
+        if match_all:
+            selected &= found
+        else:
+            selected |= found
+
+    if invert_match:
+        selected = ~selected
+    return selected.tolist()
+
+
+def vectorizable(patterns):
+    '''
+    Takes a PatternPlan as an input. Returns True if every pattern can be
+    handled by the NumPy engine and at least one of them uses a character class
+    or a repeat. Plain literals alone are left to the regular expression
+    engine, whose literal search is already fast.
+    '''
+    pattern_atoms = [simple_pattern_atoms(pattern) for pattern in patterns]
+
+    if not pattern_atoms or None in pattern_atoms:
+        return False
+    return any(len(charset) > 1 or min_repeat > 1
+               for atoms in pattern_atoms for charset, min_repeat in atoms)
+
+
+def match_sequences(patterns, sequences, invert_match=False,
+                    match_all=False):
+    '''
+    Takes a PatternPlan, a list of sequences and 2 Booleans as an input.
+    Returns a list of Booleans, one per sequence, which are True where the
+    sequence is selected. Uses the NumPy engine when possible and falls back to
+    match_patterns otherwise.
+    '''
+    selected = vectorized_matches(patterns, sequences, invert_match,
+                                  match_all)
+
+    if selected is None:
+        selected = [match_patterns(patterns, sequence,
+                                   invert_match=invert_match,
+                                   match_all=match_all)
+                    for sequence in sequences]
+    return selected
+
+
+def is_header_key(word):
+    'Returns True if the provided string can be the KEY of a KEY=VALUE field.'
+    first = word[:1]
+    return ('A' <= first <= 'Z' or 'a' <= first <= 'z') and \
+        (len(word) == 1 or word[1:].replace('_', 'a').isalnum())
+
+
+def header_brackets(header):
+    '''
+    Takes a header line as an input. Returns a list of 2-tuple (start, end)
+    spans of the bracketed fields of the header, brackets included. A bracket
+    holds no other brackets.
+    '''
+    brackets = []
+    position = header.find('[')
+
+    while position >= 0:
+        close = header.find(']', position)
+        if close < 0:
+            break
+        brackets.append((header.rfind('[', position, close), close + 1))
+        position = header.find('[', close)
+
+    return brackets
+
+
+def header_value_end(header, start, end):
+    '''
+    Takes a header line and the start of the value of a KEY=VALUE field, and
+    where the search for its end stops, as an input. Returns the index where
+    the value ends: before the next KEY=VALUE field or the stop, whichever
+    comes first, with trailing whitespace removed.
+    '''
+    equals = header.find('=', start, end)
+
+    while equals >= 0:
+        word_start = equals
+        while word_start > start and not header[word_start - 1].isspace():
+            word_start -= 1
+        if word_start > start and is_header_key(header[word_start:equals]):
+            end = word_start
+            break
+        equals = header.find('=', equals + 1, end)
+
+    while end > start and header[end - 1].isspace():
+        end -= 1
+    return end
+
+
+def header_field_spans(header, names):
+    '''
+    Takes a header line and a set of field names as an input. Tokenizes the
+    header into its fields and returns a dictionary that maps field names,
+    including each of the given names that the header holds, to the 2-tuple
+    (start, end) span of its value within the header. The identifier is named
+    id, a bracketed value without a name, e.g. [Homo sapiens], is named
+    organism. Only the given names are looked up among the identifier and the
+    KEY=VALUE fields. The header is only scanned with string methods.
+    '''
+    spans = {}
+
+    if 'id' in names and header.startswith('>'):
+        rest = header[1:2]
+        identifier = header[1:].split(None, 1)[0] \
+            if rest and not rest.isspace() else ''
+        spans['id'] = (1, 1 + len(identifier))
+
+    brackets = header_brackets(header) if '[' in header else []
+    for start, end in brackets:
+        name, sep, _ = header[start + 1:end - 1].partition('=')
+        if sep:
+            spans[name.strip()] = (start + len(name) + 2, end - 1)
+        else:
+            spans['organism'] = (start + 1, end - 1)
+
+    for name in names:
+        if name not in HEADER_KEY_NAMES:
+            HEADER_KEY_NAMES[name] = is_header_key(name)
+        if not HEADER_KEY_NAMES[name]:
+            continue
+
+        # the last KEY=VALUE field of a name is its value
+        key = name + '='
+        position = header.rfind(key)
+        while position > 0 and (not header[position - 1].isspace() or
+                                any(start < position < end
+                                    for start, end in brackets)):
+            position = header.rfind(key, 0, position)
+        if position < 0:
+            continue
+
+        start = position + len(key)
+        bracket = header.find('[', start)
+        end = header_value_end(header, start,
+                               bracket if bracket >= 0 else len(header))
+        spans[name] = (start, end)
+
+    return spans
+
+
+def get_key_filters(key_values):
+    '''
+    Takes a list of 2-tuple (key, value) pairs as an input. Returns a
+    dictionary that maps each key to the set of values it may take.
+    '''
+    key_filters = {}
+
+    for key, value in key_values or []:
+        key_filters.setdefault(key, set()).add(value)
+
+    return key_filters
+
+
+def header_scope(header, field=None, key_filters=None):
+    '''
+    Takes a header line, a field name and a dictionary of key filters, as
+    returned by get_key_filters, as an input. Returns a 3-tuple where the
+    first item is a Boolean which is True if the value of every filtered key
+    is one of its allowed values, and the second and third items are the
+    start and end of the part of the header that patterns are matched
+    against: the value of the field, if one is given, or else the whole
+    header. A missing field is treated as empty.
+    '''
+    if not field and not key_filters:
+        return True, 0, len(header)
+
+    if key_filters:
+        for values in key_filters.values():
+            for value in values:
+                if value in header:
+                    break
+            else:
+                # a substring search rules most headers out before tokenizing
+                return False, 0, 0
+        names = set(key_filters)
+    else:
+        names = set()
+
+    if field == 'organism' and '[' in header or field == 'id' or \
+            field and field in header:
+        # else the field is missing and the header need not be tokenized
+        names.add(field)
+
+    spans = header_field_spans(header, names)
+
+    for key, values in (key_filters or {}).items():
+        span = spans.get(key)
+        if not span or header[span[0]:span[1]] not in values:
+            return False, 0, 0
+
+    if field:
+        start, end = spans.get(field, (len(header), len(header)))
+        return True, start, end
+    return True, 0, len(header)
+
+
+def search_header(patterns, header, invert_match=False, color=False,
+                  match_all=False, field=None, key_filters=None):
+    '''
+    Takes a PatternPlan, a header line, 3 Booleans, a field name and a
+    dictionary of key filters as an input. Returns a Boolean, which is True if
+    the header is within the scope of the key filters and is selected by the
+    patterns, and the header, highlighted as in searchiter.
+    '''
+    if not field and not key_filters:
+        return searchiter(patterns, header, invert_match, color, match_all)
+
+    in_scope, start, end = header_scope(header, field, key_filters)
+
+    if not in_scope:
+        return False, header
+
+    pattern_found, value = searchiter(patterns, header[start:end],
+                                      invert_match, color, match_all)
+    return pattern_found, header[:start] + value + header[end:]
+
+
+def matching_sequences(patterns, file, invert_match=False, match_all=False,
+                       key_filters=None):
+    '''
+    Takes a PatternPlan, the path to a FASTA file, 2 Booleans and a dictionary
+    of key filters as an input. Yields each sequence record within the scope of
+    the key filters together with a Boolean which is True if the record is
+    selected. Records are only gathered into batches, see match_sequences, when
+    the patterns are vectorizable.
+    '''
+    records = sequence_records(file)
+
+    if key_filters:
+        records = (record for record in records
+                   if header_scope(record[0][1], None, key_filters)[0])
+
+    if not vectorizable(patterns):
+        for record in records:
+            yield record, match_patterns(patterns, record[2],
+                                         invert_match=invert_match,
+                                         match_all=match_all)
+        return
+
+    for batch in batched_records(records):
+        selected = match_sequences(
+            patterns, [sequence_data for _, _, sequence_data in batch],
+            invert_match, match_all)
+        yield from zip(batch, selected)
+
+
+def count_header_matches(patterns, file, invert_match=False, max_count=None,
+                         match_all=False, field=None, key_filters=None):
+    '''
+    Takes a PatternPlan, the path to a FASTA file, a Boolean and the
     maximum number of allowed matches (an integer) as an input. Returns the
     number of matches found within the headers of the FASTA file given the
     settings (invert match or not and the maximum allowed number of matches).
     '''
     hit_count = 0
+    scoped = field or key_filters
 
     for line in lines_in_fasta(file):
         if not is_header(line):
             continue
 
-        pattern_found, _ = searchiter(patterns, line, invert_match)
+        if scoped:
+            in_scope, start, end = header_scope(line, field, key_filters)
+            if not in_scope:
+                continue
+            line = line[start:end]
+
+        pattern_found = match_patterns(patterns, line,
+                                       invert_match=invert_match,
+                                       match_all=match_all)
 
         if pattern_found:
             hit_count += 1
@@ -216,92 +1006,62 @@ def count_header_matches(patterns, file, invert_match=False, max_count=None):
     return hit_count
 
 
-def count_seq_matches(patterns, file, invert_match=False, max_count=None):
+def count_seq_matches(patterns, file, invert_match=False, max_count=None,
+                      match_all=False, key_filters=None):
     '''
-    Takes a set of a patterns, the path to a FASTA file, a Boolean and the
+    Takes a PatternPlan, the path to a FASTA file, a Boolean and the
     maximum number of allowed matches (an integer) as an input. Returns the
     number of matches found within the sequences of the FASTA file given the
     settings (invert match or not and the maximum allowed number of matches).
     '''
     hit_count = 0
-    sequence_data = ''
 
-    for line in lines_in_fasta(file):
-        if is_header(line) and sequence_data:
-            pattern_found, _ = searchiter(
-                patterns, sequence_data, invert_match)
-            if pattern_found:
-                hit_count += 1
-                if max_count and hit_count >= max_count:
-                    return hit_count
-            sequence_data = ''
-        elif is_header(line):
-            sequence_data = ''
-            continue
-        else:
-            sequence_data += line
-
-    if sequence_data:
-        pattern_found, _ = searchiter(
-            patterns, sequence_data, invert_match)
+    for _, pattern_found in matching_sequences(patterns, file, invert_match,
+                                               match_all, key_filters):
         if pattern_found:
             hit_count += 1
             if max_count and hit_count >= max_count:
                 return hit_count
+
     return hit_count
 
 
-def count_record_matches(patterns, file, invert_match=False, max_count=None):
+def count_record_matches(patterns, file, invert_match=False, max_count=None,
+                         match_all=False, field=None, key_filters=None):
     '''
-    Takes a set of a patterns, the path to a FASTA file, a Boolean and the
+    Takes a PatternPlan, the path to a FASTA file, a Boolean and the
     maximum number of allowed matches (an integer) as an input. Returns the
-    number of matches found within the sequences of the FASTA file given the
-    settings (invert match or not and the maximum allowed number of matches).
+    number of matches found within whole records (headers and sequences) of
+    the FASTA file given the settings (invert match or not and the maximum
+    allowed number of matches).
     '''
-    last_header = ''
-    sequence_data = ''
     hit_count = 0
 
-    for line in lines_in_fasta(file):
-        if is_header(line) and sequence_data:
-            header_match, _ = searchiter(
-                patterns, last_header, invert_match)
-
-            seq_match, _ = searchiter(
-                patterns, sequence_data, invert_match)
-
-            if header_match or seq_match:
-                hit_count += 1
-
-                if max_count and hit_count >= max_count:
-                    return hit_count
+    scoped = field or key_filters
 
-            last_header = line
-            sequence_data = ''
-        elif is_header(line):
-            last_header = line
-            sequence_data = ''
-            continue
-        else:
-            sequence_data += line
-
-    if sequence_data:
-        header_match, _ = searchiter(
-            patterns, last_header, invert_match)
+    for header, _, sequence_data in sequence_records(file):
+        value = header[1]
+        if scoped:
+            in_scope, start, end = header_scope(value, field, key_filters)
+            if not in_scope:
+                continue
+            value = value[start:end]
 
-        seq_match, _ = searchiter(
-            patterns, sequence_data, invert_match)
+        pattern_found = match_patterns(patterns, value, sequence_data,
+                                       invert_match=invert_match,
+                                       match_all=match_all)
 
-        if header_match or seq_match:
+        if pattern_found:
             hit_count += 1
-
             if max_count and hit_count >= max_count:
                 return hit_count
+
     return hit_count
 
 
 def search_headers(patterns, file, invert_match=False, color=False,
-                   max_count=None):
+                   max_count=None, match_all=False, field=None,
+                   key_filters=None):
     '''
     Takes a list of patterns and a FASTA file path as an input. For each header
     with a matching pattern, yield the whole record in the form of tuples; each
@@ -310,11 +1070,16 @@ def search_headers(patterns, file, invert_match=False, color=False,
     '''
     pattern_found = False
     hit_count = 0
+    scoped = field or key_filters
 
     for line_number, line in enumerate(lines_in_fasta(file), 1):
-        if is_header(line):
+        if scoped and is_header(line):
+            pattern_found, line = search_header(patterns, line, invert_match,
+                                                color, match_all, field,
+                                                key_filters)
+        elif is_header(line):
             pattern_found, line = searchiter(patterns, line, invert_match,
-                                             color)
+                                             color, match_all)
 
         if pattern_found and is_header(line):
             hit_count += 1
@@ -358,199 +1123,292 @@ def split_lines(string, linebreaks, spans):
         offset += linebreak
 
 
-def searchiter_w_linebreaks(patterns, string, invert_match=False, color=False,
-                            linebreaks=False):
+def record_lines(patterns, record, span=None, highlight_header=False,
+                 highlight_sequence=False):
     '''
-    Takes a set of regular expression pattern objects, a string, 2 Booleans,
-    and a set of 2-tuples as an input. If color is set, highlight each matching
-    group in the string. If a set of linebreaks is provided, also break the
-    provided string into lines, as specified by the 2-tuples.
+    Takes a PatternPlan, a sequence record, as yielded by sequence_records, a
+    2-tuple span of the header and 2 Booleans as an input. Yields each line of
+    the record as a 2-tuple of line number and line. Matches within the span of
+    the header and within the sequence are highlighted if the respective
+    Boolean is set.
     '''
-    pattern_found = False
-    spans = set()
+    current_header, sequence_lines, sequence_data = record
+    header_line_number, header_line = current_header
 
-    for pattern in patterns:
-        pattern_found = is_hit(pattern.search(string), invert_match)
+    if highlight_header:
+        start, end = span or (0, len(header_line))
+        value = header_line[start:end]
+        value = highlight_spans(value, pattern_spans(patterns, value))
+        header_line = header_line[:start] + value + header_line[end:]
 
-        if not pattern_found:
-            continue
+    yield header_line_number, header_line
 
-        if pattern_found and (color and not invert_match):
-            for result in pattern.finditer(string):
-                spans.add(result.span())
-        else:
-            break
+    seq_spans = []
+    if highlight_sequence:
+        seq_spans = pattern_spans(patterns, sequence_data)
 
-    spans = merge_overlapping_spans(spans)
-
-    if pattern_found:
-        for line_number, line in split_lines(string, linebreaks, spans):
-            yield line_number, line
+    linebreaks = record_linebreaks(current_header, sequence_lines)
+    for seq_line_no, seq_line in split_lines(sequence_data, linebreaks,
+                                             seq_spans):
+        yield seq_line_no, seq_line
 
 
 def search_sequences(patterns, file, invert_match=False, color=False,
-                     max_count=None):
+                     max_count=None, match_all=False, key_filters=None):
     '''
     Takes a pattern string and a FASTA file path as an input. For each sequence
     with a matching pattern, yield the whole record in the form of a tuple;
     each tuple represents one line where the first item is the line itself and
     the second item is a Boolean which is True if the preceeding item is a
-    header.
+    header. Sequences are matched in batches, see matching_sequences.
     '''
-    linebreaks = set()
-    sequence_data = ''
-    current_header = ()
     hit_count = 0
 
-    for line_number, line in enumerate(lines_in_fasta(file), 1):
+    for record, pattern_found in matching_sequences(patterns, file,
+                                                    invert_match, match_all,
+                                                    key_filters):
+        if not pattern_found:
+            continue
+
         if max_count and hit_count >= max_count:
             return
 
-        if is_header(line):
-            if sequence_data:
-                hits = searchiter_w_linebreaks(
-                    patterns, sequence_data, invert_match, color, linebreaks)
+        hit_count += 1
+        yield from record_lines(patterns, record,
+                                highlight_sequence=color and not invert_match)
 
-                first_iteration = True
 
-                for seq_line_no, seq_line in hits:
-                    if first_iteration:
-                        hit_count += 1
-                        yield current_header
+def search_records(patterns, file, invert_match=False, color=False,
+                   max_count=None, match_all=False, field=None,
+                   key_filters=None):
+    '''
+    Takes a pattern string and a FASTA file path as an input. Search whole
+    sequence records (both headers and sequence data) for a matching pattern.
+    For each match, yield the entire record in the form of a tuple; each tuple
+    represents one line where the first item is the line itself and the second
+    item is a Boolean which is True if the preceeding item is a header.
+    '''
+    hit_count = 0
+    highlight = color and not invert_match
 
-                    yield seq_line_no, seq_line
-                    first_iteration = False
+    scoped = field or key_filters
 
-            current_header = (line_number, line)
-            sequence_data = ''
-            linebreaks = set()
+    for record in sequence_records(file):
+        header_line = record[0][1]
+        if scoped:
+            in_scope, start, end = header_scope(header_line, field,
+                                                key_filters)
+            if not in_scope:
+                continue
         else:
-            linebreaks.add((line_number, len(line)))
-            sequence_data += line
+            start, end = 0, len(header_line)
 
-    if sequence_data:
-        hits = searchiter_w_linebreaks(
-            patterns, sequence_data, invert_match, color, linebreaks)
+        if not match_patterns(patterns, header_line[start:end], record[2],
+                              invert_match=invert_match, match_all=match_all):
+            continue
 
-        first_iteration = True
+        if max_count and hit_count >= max_count:
+            return
 
-        for seq_line_no, seq_line in hits:
-            if first_iteration:
-                hit_count += 1
-                yield current_header
+        hit_count += 1
+        yield from record_lines(patterns, record, (start, end), highlight,
+                                highlight)
 
-            yield seq_line_no, seq_line
-            first_iteration = False
 
+def read_queries(queries_file, ignore_case=False, fixed_strings=False,
+                 default_mode='headers'):
+    '''
+    Takes the path to a tab-separated file of queries, 2 Booleans and a search
+    mode as an input. Each line of the file holds a query name, a pattern or
+    the path to a file of patterns, and optionally the search mode of the
+    query (one of QUERY_MODES, default_mode if left out). Empty lines and
+    lines that start with a hash sign are skipped. Returns a list of 3-tuples
+    (name, PatternPlan, mode). Queries that use the same patterns share one
+    PatternPlan. Raises ValueError, naming the file and line, if a line is
+    malformed, its pattern is invalid or its patterns file can not be read.
+    '''
+    import re
 
-def search_records(patterns, file, invert_match=False, color=False,
-                   max_count=None):
+    queries = []
+    names = set()
+    plans = {}
+
+    with open(queries_file) as file:
+        for line_number, line in enumerate(file, 1):
+            line = line.rstrip('\r\n')
+            if not line.strip() or line.startswith('#'):
+                continue
+
+            columns = line.split('\t')
+            name = columns[0]
+            mode = columns[2] if len(columns) == 3 else default_mode
+            location = '{}, line {}'.format(queries_file, line_number)
+
+            if len(columns) not in (2, 3):
+                raise ValueError('{}: expected NAME, PATTERN and optionally '
+                                 'MODE, separated by tabs'.format(location))
+            if mode not in QUERY_MODES:
+                raise ValueError('{}: unknown mode {!r}, expected one of {}'
+                                 .format(location, mode,
+                                         ', '.join(QUERY_MODES)))
+            if not name or name in names or \
+                    os.path.basename(name) != name or name in ('.', '..'):
+                raise ValueError('{}: query name {!r} is empty, repeated or '
+                                 'not a valid file name'
+                                 .format(location, name))
+            names.add(name)
+
+            source = columns[1]
+            if source not in plans:
+                try:
+                    if os.path.isfile(source):
+                        plans[source] = get_patterns(False, source,
+                                                     ignore_case,
+                                                     fixed_strings)
+                    else:
+                        plans[source] = get_patterns(source, False,
+                                                     ignore_case,
+                                                     fixed_strings)
+                except (re.error, OSError) as error:
+                    raise ValueError('{}: {}'.format(location, error))
+            queries.append((name, plans[source], mode))
+
+    return queries
+
+
+def union_pattern(patterns):
     '''
-    Takes a pattern string and a FASTA file path as an input. Search whole
-    sequence records (both headers and sequence data) for a matching pattern.
-    For each match, yield the entire record in the form of a tuple; each tuple
-    represents one line where the first item is the line itself and the second
-    item is a Boolean which is True if the preceeding item is a header.
+    Takes an iterable of regular expression Pattern objects as an input.
+    Returns a single Pattern object, an alternation of all the patterns,
+    which is found wherever any of the patterns is found. Returns None if
+    there are no patterns or they can not be combined, because they use
+    different flags, capturing groups (whose numbers would shift) or inline
+    flags.
     '''
-    linebreaks = set()
-    last_header = ''
-    sequence_data = ''
-    hit_count = 0
+    import re
 
-    for line_number, line in enumerate(lines_in_fasta(file), 1):
-        if is_header(line) and sequence_data:
-            header_match, header_line = searchiter(
-                patterns, last_header[1], invert_match, color)
-            seq_match, _ = searchiter(
-                patterns, sequence_data, invert_match)
-            header_line_number = last_header[0]
-
-            if seq_match:
-                if max_count and hit_count >= max_count:
-                    return
-
-                hits = searchiter_w_linebreaks(
-                    patterns, sequence_data, invert_match, color, linebreaks)
-                first_iteration = True
-
-                for seq_line_no, seq_line in hits:
-                    if first_iteration:
-                        yield header_line_number, header_line
-
-                    yield seq_line_no, seq_line
-                    first_iteration = False
-
-                hit_count += 1
-            elif header_match:
-                if max_count and hit_count >= max_count:
-                    return
-
-                yield header_line_number, header_line
-                offset = 0
-
-                for subseq_line_no, linebreak in sorted(linebreaks):
-                    start = offset
-                    end = offset + linebreak
-                    subseq = sequence_data[start:end]
-                    yield subseq_line_no, subseq
-                    offset += linebreak
-
-                hit_count += 1
-
-            last_header = line_number, line
-            sequence_data = ''
-            linebreaks = set()
-        elif is_header(line):
-            last_header = line_number, line
-            sequence_data = ''
-            linebreaks = set()
-            continue
+    patterns = list(patterns)
+    flags = {pattern.flags for pattern in patterns}
+
+    if len(flags) != 1 or any(pattern.groups for pattern in patterns):
+        return None
+
+    try:
+        return re.compile('|'.join('(?:{})'.format(pattern.pattern)
+                                   for pattern in patterns), flags.pop())
+    except re.error:
+        return None
+
+
+def query_matches(queries, file, invert_match=False, max_count=None,
+                  match_all=False, field=None, key_filters=None):
+    '''
+    Takes a list of queries, as returned by read_queries, the path to a FASTA
+    file, a Boolean, the maximum number of matches per query, a Boolean, a
+    field name and a dictionary of key filters as an input. Reads the file
+    once and yields a 4-tuple (name, PatternPlan, record, header span) for
+    each record that a query selects, in the order of the file. The patterns
+    of all queries of a mode are first searched at once, see union_pattern,
+    and the queries are only evaluated one by one, sharing the result of each
+    pattern, if any of them is found within the record (or if invert_match
+    is set). Each header is tokenized once for all queries.
+    '''
+    hit_counts = dict.fromkeys((name for name, _, _ in queries), 0)
+    unions = {}
+    for mode in {mode for _, _, mode in queries}:
+        unions[mode] = union_pattern({pattern for _, patterns, query_mode
+                                      in queries if query_mode == mode
+                                      for pattern in patterns})
+
+    scoped = field or key_filters
+
+    for record in sequence_records(file, include_empty=True):
+        header_line, sequence_data = record[0][1], record[2]
+        if scoped:
+            in_scope, start, end = header_scope(header_line, field,
+                                                key_filters)
+            if not in_scope:
+                continue
+            value = header_line[start:end]
         else:
-            sequence_data += line
-            linebreaks.add((line_number, len(line)))
+            start, end = 0, len(header_line)
+            value = header_line
+        strings = {'headers': (value,),
+                   'sequences': (sequence_data,),
+                   'records': (value, sequence_data)}
+        found = {}
+        for mode, union in unions.items():
+            found[mode] = union is None or \
+                any(union.search(string) for string in strings[mode])
+
+        if not invert_match and not any(found.values()):
+            # no pattern of any query is found, so no query selects the record
+            continue
 
-    if sequence_data:
-        header_match, header_line = searchiter(
-            patterns, last_header[1], invert_match, color)
-        seq_match, _ = searchiter(
-            patterns, sequence_data, invert_match)
-        header_line_number = last_header[0]
+        caches = {mode: {} for mode in QUERY_MODES}
 
-        if seq_match:
-            if max_count and hit_count >= max_count:
-                return
+        for name, patterns, mode in queries:
+            if max_count and hit_counts[name] >= max_count:
+                continue
+            if mode != 'headers' and not sequence_data:
+                # records without sequence data are only searched by headers
+                continue
 
-            hits = searchiter_w_linebreaks(
-                patterns, sequence_data, invert_match, color, linebreaks)
-            first_iteration = True
+            if found[mode]:
+                selected = match_patterns(patterns, *strings[mode],
+                                          invert_match=invert_match,
+                                          match_all=match_all,
+                                          cache=caches[mode])
+            else:
+                # none of the patterns is found, see match_patterns
+                selected = invert_match and bool(patterns)
 
-            for seq_line_no, seq_line in hits:
-                if first_iteration:
-                    yield header_line_number, header_line
+            if selected:
+                hit_counts[name] += 1
+                yield name, patterns, record, (start, end)
 
-                yield seq_line_no, seq_line
-                first_iteration = False
 
-            hit_count += 1
-        elif header_match:
-            if max_count and hit_count >= max_count:
-                return
+def search_queries(queries, file, invert_match=False, color=False,
+                   max_count=None, match_all=False, field=None,
+                   key_filters=None):
+    '''
+    Takes a list of queries and the search settings as an input, see
+    query_matches. For each record that a query selects, yield the lines of
+    the record as 3-tuples of query name, line number and line.
+    '''
+    highlight = color and not invert_match
+    modes = {name: mode for name, _, mode in queries}
 
-            yield header_line_number, header_line
-            offset = 0
+    for name, patterns, record, span in query_matches(
+            queries, file, invert_match, max_count, match_all, field,
+            key_filters):
+        mode = modes[name]
+        for line_number, line in record_lines(
+                patterns, record, span, highlight and mode != 'sequences',
+                highlight and mode != 'headers'):
+            yield name, line_number, line
 
-            for subseq_line_no, linebreak in sorted(linebreaks):
-                start = offset
-                end = offset + linebreak
-                subseq = sequence_data[start:end]
-                yield subseq_line_no, subseq
-                offset += linebreak
 
-            hit_count += 1
+def count_queries(queries, file, invert_match=False, max_count=None,
+                  match_all=False, field=None, key_filters=None):
+    '''
+    Takes a list of queries and the search settings as an input, see
+    query_matches. Returns a dictionary that maps each query name to the
+    number of records the query selects, in the order of the queries.
+    '''
+    hit_counts = dict.fromkeys((name for name, _, _ in queries), 0)
+
+    for name, _, _, _ in query_matches(queries, file, invert_match, max_count,
+                                       match_all, field, key_filters):
+        hit_counts[name] += 1
+
+    return hit_counts
 
 
 def stdin_has_data():
     'Returns True if stdin contains any data.'
+    import select
+
     return select.select([sys.stdin, ], [], [], 0.0)[0]
 
 
@@ -620,6 +1478,293 @@ def output_records(hits, line_number=False, color=False):
             print(line)
 
 
+class RecordTable:
+    '''
+    Takes the path to a FASTA file and its os.stat result as an input. Holds
+    one row per record of the file: the byte offsets of its header and of its
+    sequence, its sequence length, the width of its first sequence line and
+    the line number of its header. Each column is a compact array (see
+    TABLE_COLUMNS), so that a table takes a few tens of bytes per record.
+    Records are read back in any order by seeking into the FASTA file.
+    '''
+
+    def __init__(self, path, stat):
+        from array import array
+
+        self.path = path
+        self.size = stat.st_size
+        self.mtime = stat.st_mtime_ns
+
+        for name, typecode in TABLE_COLUMNS:
+            setattr(self, name, array(typecode))
+
+    def __len__(self):
+        return len(self.header_offsets)
+
+    def record_end(self, index):
+        'Takes a record index and returns the byte offset where it ends.'
+        if index + 1 < len(self):
+            return self.header_offsets[index + 1]
+        return self.size
+
+    def read_header(self, file, index):
+        '''
+        Takes a FASTA file opened in binary mode and a record index as an
+        input. Returns the header as a 2-tuple of line number and line.
+        '''
+        file.seek(self.header_offsets[index])
+        return self.line_numbers[index], file.readline().decode().rstrip()
+
+    def read_sequence(self, file, index):
+        '''
+        Takes a FASTA file opened in binary mode and a record index as an
+        input. Returns the sequence data of the record as a string.
+        '''
+        start = self.sequence_offsets[index]
+        file.seek(start)
+        data = file.read(self.record_end(index) - start)
+        sequence = data.replace(b'\n', b'')
+
+        if len(sequence) != self.lengths[index]:
+            # lines end with carriage returns or other whitespace
+            sequence = b''.join(line.rstrip() for line in data.split(b'\n'))
+        return sequence.decode()
+
+    def read(self, file, index):
+        '''
+        Takes a FASTA file opened in binary mode and a record index as an
+        input. Returns the record as a 3-tuple, like sequence_records.
+        '''
+        header = self.read_header(file, index)
+        start = self.sequence_offsets[index]
+        file.seek(start)
+        lines = file.read(self.record_end(index) - start).decode().split('\n')
+
+        if lines[-1] == '':
+            # the newline that ends the last line
+            lines.pop()
+
+        sequence_lines = [line.rstrip() for line in lines]
+        return header, sequence_lines, ''.join(sequence_lines)
+
+    def save(self, table_path):
+        'Takes a path as an input and writes the table to it.'
+        from array import array
+
+        with open(table_path, 'wb') as file:
+            file.write(TABLE_MAGIC)
+            array('Q', [self.size, self.mtime, len(self)]).tofile(file)
+            for name, _ in TABLE_COLUMNS:
+                getattr(self, name).tofile(file)
+
+    @classmethod
+    def load(cls, table_path, path):
+        '''
+        Takes the path to a saved table and the path to its FASTA file as an
+        input. Returns the table, or None if the saved table is unreadable or
+        the FASTA file has changed since the table was built.
+        '''
+        from array import array
+
+        stat = os.stat(path)
+        table = cls(path, stat)
+        info = array('Q')
+
+        try:
+            with open(table_path, 'rb') as file:
+                if file.read(len(TABLE_MAGIC)) != TABLE_MAGIC:
+                    return None
+                info.fromfile(file, 3)
+                if (info[0], info[1]) != (table.size, table.mtime):
+                    return None
+                for name, _ in TABLE_COLUMNS:
+                    getattr(table, name).fromfile(file, info[2])
+        except (EOFError, OSError):
+            return None
+
+        return table
+
+
+def build_record_table(path):
+    '''
+    Takes the path to a FASTA file as an input. Reads the file once and
+    returns its RecordTable. Lines before the first header are not part of
+    any record.
+    '''
+    table = RecordTable(path, os.stat(path))
+    offset = 0
+    first_line = False
+
+    with open(path, 'rb') as file:
+        for line_number, line in enumerate(file, 1):
+            if line.startswith(b'>'):
+                table.header_offsets.append(offset)
+                table.sequence_offsets.append(offset + len(line))
+                table.lengths.append(0)
+                table.widths.append(0)
+                table.line_numbers.append(line_number)
+                first_line = True
+            elif len(table):
+                width = len(line.rstrip())
+                table.lengths[-1] += width
+                if first_line:
+                    table.widths[-1] = width
+                    first_line = False
+            offset += len(line)
+
+    return table
+
+
+def get_record_table(path, table_path=None):
+    '''
+    Takes the path to a FASTA file and an optional path to a saved table as
+    an input. Returns the saved table if it is still valid, else builds the
+    table and, if a table path is given, saves it there. Raises ValueError
+    rather than overwrite a file that is not a record table.
+    '''
+    table = None
+    if table_path and os.path.exists(table_path):
+        if os.path.samefile(table_path, path):
+            raise ValueError("'{}' is the FASTA file, not a record table"
+                             .format(table_path))
+        with open(table_path, 'rb') as file:
+            # tables of either byte order may be replaced
+            if not file.read(len(TABLE_MAGIC)).startswith(TABLE_MAGIC[:-1]):
+                raise ValueError("'{}' exists and is not a record table"
+                                 .format(table_path))
+        table = RecordTable.load(table_path, path)
+
+    if table is None:
+        table = build_record_table(path)
+        if table_path:
+            table.save(table_path)
+
+    return table
+
+
+def select_table_records(table, file, patterns, mode='headers',
+                         invert_match=False, match_all=False, field=None,
+                         key_filters=None):
+    '''
+    Takes a RecordTable, the FASTA file opened in binary mode, a PatternPlan, a
+    search mode (one of QUERY_MODES), 2 Booleans, a field name and a dictionary
+    of key filters as an input. Returns an array of the indices of the selected
+    records, in the order of the file. As in the other search modes, only
+    headers are searched in records without sequence data.
+    '''
+    from array import array
+
+    selected = array('Q')
+
+    for index in range(len(table)):
+        if mode != 'headers' and not table.lengths[index]:
+            continue
+
+        header_line = table.read_header(file, index)[1]
+        if mode != 'headers':
+            sequence_data = table.read_sequence(file, index)
+
+        in_scope, start, end = header_scope(header_line, field, key_filters)
+        if not in_scope:
+            continue
+
+        if mode == 'headers':
+            strings = (header_line[start:end],)
+        elif mode == 'sequences':
+            strings = (sequence_data,)
+        else:
+            strings = (header_line[start:end], sequence_data)
+
+        if match_patterns(patterns, *strings, invert_match=invert_match,
+                          match_all=match_all):
+            selected.append(index)
+
+    return selected
+
+
+def order_table_records(table, file, indices, sort_by=None, max_count=None,
+                        sample=None, seed=None):
+    '''
+    Takes a RecordTable, the FASTA file opened in binary mode, a sequence of
+    record indices, a sort key (length or id), the maximum number of records,
+    a sample size and a random seed as an input. Returns the indices sorted
+    by the key, cut to max_count and, if a sample size is given, reduced to a
+    random sample of that size that keeps the order.
+    '''
+    indices = list(indices)
+
+    if sort_by == 'length':
+        indices.sort(key=table.lengths.__getitem__)
+    elif sort_by == 'id':
+        def identifier(index):
+            file.seek(table.header_offsets[index])
+            return file.readline()[1:].split(None, 1)[:1]
+        indices.sort(key=identifier)
+
+    if max_count:
+        indices = indices[:max_count]
+
+    if sample is not None and sample < len(indices):
+        import random
+        positions = random.Random(seed).sample(range(len(indices)), sample)
+        indices = [indices[position] for position in sorted(positions)]
+
+    return indices
+
+
+def search_table(table, file, indices, patterns, mode='headers',
+                 invert_match=False, color=False, field=None):
+    '''
+    Takes a RecordTable, the FASTA file opened in binary mode, a sequence of
+    record indices, a PatternPlan, a search mode, 2 Booleans and a field name
+    as an input. Yields the lines of each record, in the order of the indices,
+    as 2-tuples of line number and line.
+    '''
+    highlight = color and not invert_match
+
+    for index in indices:
+        record = table.read(file, index)
+        span = header_scope(record[0][1], field)[1:]
+        yield from record_lines(patterns, record, span,
+                                highlight and mode != 'sequences',
+                                highlight and mode != 'headers')
+
+
+def output_queries(hits, names, line_number=False, color=False,
+                   output_dir=None, headers=True, sequences=True):
+    '''
+    Takes the lines selected by search_queries, the list of query names, 2
+    Booleans, an optional directory and 2 Booleans, which say whether headers
+    and sequences are output, as an input. If a directory is given, write the
+    lines of each query to the file NAME.fasta within it, else print each
+    line prefixed with the name of its query.
+    '''
+    files = {}
+
+    try:
+        if output_dir:
+            for name in names:
+                files[name] = open(os.path.join(output_dir, name + '.fasta'),
+                                   'w')
+
+        for name, number, line in hits:
+            if not headers and is_header(line) or \
+                    not sequences and not is_header(line):
+                continue
+
+            prefix = str(number) + ':' if line_number else ''
+            if output_dir:
+                files[name].write(prefix + line + '\n')
+            elif color:
+                line_no = GREEN + prefix[:-1] + CYAN + ':' if prefix else ''
+                print(MAGENTA + name + CYAN + ':' + line_no + NORMAL + line)
+            else:
+                print(name + ':' + prefix + line)
+    finally:
+        for file in files.values():
+            file.close()
+
+
 def verify_args(arguments):
     '''
     Process the provided argument object and perform some basic sanity checks.
@@ -627,10 +1772,18 @@ def verify_args(arguments):
     fasta_file = arguments.fasta_file
     pattern = arguments.pattern
 
-    if not arguments.fasta_file and stdin_has_data():
+    if not arguments.fasta_file and arguments.pattern and (
+            arguments.queries or (arguments.key or arguments.file) and
+            os.path.isfile(arguments.pattern)):
+        # PATTERN is optional with --key and --file and not allowed with
+        # --queries, so a sole file argument is FILE, even if stdin is
+        # readable, e.g. redirected from /dev/null
+        fasta_file = arguments.pattern
+        pattern = ''
+    elif not arguments.fasta_file and stdin_has_data():
         # FILE was not provided and stdin contains data, read input from stdin
         fasta_file = sys.stdin
-    elif os.path.isfile(arguments.pattern):
+    elif arguments.pattern and os.path.isfile(arguments.pattern):
         # PATTERN is a file assign this file to fasta_file
         fasta_file = arguments.pattern
         pattern = ''
@@ -638,9 +1791,62 @@ def verify_args(arguments):
     return fasta_file, pattern
 
 
+def key_value(string):
+    '''
+    Takes a string of the form KEY=VALUE as an input and returns the 2-tuple
+    (KEY, VALUE). Used as the argument type of --key.
+    '''
+    key, sep, value = string.partition('=')
+
+    if not sep or not key:
+        import argparse
+        raise argparse.ArgumentTypeError(
+            "expected KEY=VALUE, got '{}'".format(string))
+    return key, value
+
+
+class Arguments:
+    '''
+    Parsed command line arguments, as attributes named like those of the
+    argparse namespace that parse_args returns.
+    '''
+
+    def __init__(self, **values):
+        self.__dict__.update(DEFAULT_ARGUMENTS, **values)
+
+
+def sample_size(string):
+    '''
+    Takes a string as an input and returns it as a non-negative integer. Used
+    as the argument type of --sample.
+    '''
+    import argparse
+
+    try:
+        size = int(string)
+    except ValueError:
+        size = -1
+    if size < 0:
+        raise argparse.ArgumentTypeError(
+            "expected a non-negative integer, got '{}'".format(string))
+    return size
+
+
 def parse_args():
-    'Parse the user-provided arguments.'
+    '''
+    Parse the user-provided arguments. A plain PATTERN FILE search, the most
+    common call, is parsed without building the argument parser.
+    '''
+    arguments = sys.argv[1:]
+
+    if len(arguments) == 2 and \
+            not any(argument.startswith('-') for argument in arguments):
+        return Arguments(pattern=arguments[0], fasta_file=arguments[1])
+
+    import argparse
+
     parser = argparse.ArgumentParser(description=__doc__, add_help=False)
+    parser.set_defaults(**DEFAULT_ARGUMENTS)
 
     group = parser.add_argument_group('pattern selection and interpretation')
     group.add_argument('-F', '--fixed-strings',
@@ -663,6 +1869,35 @@ def parse_args():
                        action='store_true',
                        default=False,
                        help='look for PATTERN in headers and sequences')
+    group.add_argument('--field',
+                       metavar='NAME',
+                       default=None,
+                       help='only look for PATTERN in the header field NAME, \
+                             e.g. id, OS, GN or organism')
+    group.add_argument('--key',
+                       metavar='KEY=VALUE',
+                       action='append',
+                       type=key_value,
+                       help='only select records whose header field KEY is \
+                             VALUE; repeat for several allowed values or keys')
+    group.add_argument('--queries',
+                       metavar='FILE',
+                       help='run every query in the tab-separated FILE in a \
+                             single pass; each line holds a query name, a \
+                             pattern or patterns file, and optionally the \
+                             mode: headers, sequences (not with --field) \
+                             or records')
+    exclusive = group.add_mutually_exclusive_group()
+    exclusive.add_argument('--all-patterns',
+                           dest='all_patterns',
+                           action='store_true',
+                           default=False,
+                           help='select records that match every pattern')
+    exclusive.add_argument('--any-pattern',
+                           dest='all_patterns',
+                           action='store_false',
+                           help='select records that match any pattern \
+                                 (default)')
 
     group = parser.add_argument_group('miscellaneous')
     group.add_argument('-V', '--version',
@@ -672,7 +1907,9 @@ def parse_args():
     group.add_argument('-v', '--invert-match',
                        action='store_true',
                        default=False,
-                       help='select non-matching lines')
+                       help='select records that are not matched, i.e. \
+                             that no pattern matches (or, with \
+                             --all-patterns, that not every pattern matches)')
     group.add_argument('--help',
                        action='help',
                        help='display this help text and exit')
@@ -703,6 +1940,31 @@ def parse_args():
                        action='store_true',
                        default=False,
                        help='only output the sequences of matching records')
+    group.add_argument('--sort-by',
+                       choices=('length', 'id'),
+                       default=None,
+                       help='output matching records sorted by sequence \
+                             length or by identifier')
+    group.add_argument('--sample',
+                       metavar='NUM',
+                       default=None,
+                       type=sample_size,
+                       help='output a random sample of NUM matching records')
+    group.add_argument('--seed',
+                       metavar='NUM',
+                       default=None,
+                       type=int,
+                       help='seed the random number generator of --sample')
+    group.add_argument('--record-table',
+                       metavar='FILE',
+                       default=None,
+                       help='load the record offset table of the FASTA file \
+                             from FILE, or build it and save it there')
+    group.add_argument('--output-dir',
+                       metavar='DIR',
+                       default=None,
+                       help='with --queries, write the records of each query \
+                             to DIR/NAME.fasta instead of printing them')
 
     parser.add_argument('pattern',
                         metavar='PATTERN',
@@ -719,6 +1981,103 @@ def parse_args():
     return parser.parse_args(args=None if sys.argv[1:] else ['--help'])
 
 
+def run_table(args, fasta_file, patterns, color, key_filters):
+    '''
+    Select records by first building (or loading) the record table of the
+    FASTA file, then sort, cut and sample the selected records, and output
+    them by seeking into the file, as requested by the parsed arguments.
+    '''
+    if not isinstance(fasta_file, str):
+        sys.exit('bfg: error: --sort-by, --sample and --record-table need a '
+                 'FASTA file, not standard input')
+
+    if args.search_sequences:
+        mode = 'sequences'
+    elif args.search_records:
+        mode = 'records'
+    else:
+        mode = 'headers'
+
+    try:
+        table = get_record_table(fasta_file, args.record_table)
+    except (OSError, ValueError) as error:
+        sys.exit('bfg: error: {}'.format(error))
+
+    with open(fasta_file, 'rb') as file:
+        selected = select_table_records(table, file, patterns, mode,
+                                        args.invert_match, args.all_patterns,
+                                        args.field, key_filters)
+        indices = order_table_records(table, file, selected, args.sort_by,
+                                      args.max_count, args.sample, args.seed)
+
+        if args.count:
+            print(len(indices))
+            return
+
+        hits = search_table(table, file, indices, patterns, mode,
+                            args.invert_match, color, args.field)
+
+        if args.output_sequences and not args.output_headers:
+            output_seqs(hits, args.line_number, color)
+        elif args.output_headers and not args.output_sequences:
+            output_headers(hits, args.line_number, color)
+        else:
+            output_records(hits, args.line_number, color)
+
+
+def run_queries(args, fasta_file, pattern, color, key_filters):
+    '''
+    Run all queries of the --queries file in one pass over the FASTA file and
+    output their results, as requested by the parsed arguments.
+    '''
+    if pattern or args.file:
+        sys.exit('bfg: error: --queries can not be combined with PATTERN or '
+                 '--file')
+    if args.sort_by or args.sample is not None or args.record_table:
+        sys.exit('bfg: error: --queries can not be combined with --sort-by, '
+                 '--sample or --record-table')
+    if args.output_dir and not os.path.isdir(args.output_dir):
+        sys.exit("bfg: error: '{}' is not a directory".format(args.output_dir))
+    if not fasta_file:
+        sys.exit('bfg: error: --queries needs a FASTA file, or data on '
+                 'standard input')
+
+    if args.search_sequences:
+        default_mode = 'sequences'
+    elif args.search_records:
+        default_mode = 'records'
+    else:
+        default_mode = 'headers'
+
+    try:
+        queries = read_queries(args.queries, args.ignore_case,
+                               args.fixed_strings, default_mode)
+    except (OSError, ValueError) as error:
+        sys.exit('bfg: error: {}'.format(error))
+
+    if args.field and any(mode == 'sequences' for _, _, mode in queries):
+        sys.exit('bfg: error: --field can not be combined with queries in '
+                 'sequences mode')
+
+    if args.count:
+        hit_counts = count_queries(queries, fasta_file, args.invert_match,
+                                   args.max_count, args.all_patterns,
+                                   args.field, key_filters)
+        for name, hit_count in hit_counts.items():
+            print(name + ':' + str(hit_count))
+        return
+
+    # files are never colorized
+    color = color and not args.output_dir
+    hits = search_queries(queries, fasta_file, args.invert_match, color,
+                          args.max_count, args.all_patterns, args.field,
+                          key_filters)
+    headers = args.output_headers or not args.output_sequences
+    sequences = args.output_sequences or not args.output_headers
+    output_queries(hits, [name for name, _, _ in queries], args.line_number,
+                   color, args.output_dir, headers, sequences)
+
+
 def main():
     'Run the program from start to finish.'
     args = parse_args()
@@ -728,18 +2087,42 @@ def main():
         # the output is being redirected or the terminal is lacking color support
         color = False
 
+    if args.field and args.search_sequences:
+        sys.exit('bfg: error: --field can not be combined with '
+                 '--search-sequences')
+
     fasta_file, pattern = verify_args(args)
+    key_filters = get_key_filters(args.key)
+
+    if args.queries:
+        run_queries(args, fasta_file, pattern, color, key_filters)
+        return
+    if args.output_dir:
+        sys.exit('bfg: error: --output-dir requires --queries')
+
     patterns = get_patterns(pattern, args.file, args.ignore_case,
                             args.fixed_strings)
 
+    if not patterns and key_filters:
+        # only key filters were given, select every record within their scope
+        patterns.add(add_pattern(''))
+
+    if args.sort_by or args.sample is not None or args.record_table:
+        run_table(args, fasta_file, patterns, color, key_filters)
+        return
+
     if args.count and args.search_sequences:
-        hit_count = count_seq_matches(patterns, fasta_file, args.invert_match, args.max_count)
+        hit_count = count_seq_matches(patterns, fasta_file, args.invert_match,
+                                      args.max_count, args.all_patterns,
+                                      key_filters)
     elif args.count and args.search_records:
         hit_count = count_record_matches(patterns, fasta_file, args.invert_match,
-                                         args.max_count)
+                                         args.max_count, args.all_patterns,
+                                         args.field, key_filters)
     elif args.count:
         hit_count = count_header_matches(patterns, fasta_file, args.invert_match,
-                                         args.max_count)
+                                         args.max_count, args.all_patterns,
+                                         args.field, key_filters)
 
     if args.count:
         # count requested, only print the number of matches
@@ -748,13 +2131,15 @@ def main():
 
     if args.search_sequences:
         hits = search_sequences(patterns, fasta_file, args.invert_match, color,
-                                args.max_count)
+                                args.max_count, args.all_patterns, key_filters)
     elif args.search_records:
         hits = search_records(patterns, fasta_file, args.invert_match, color,
-                              args.max_count)
+                              args.max_count, args.all_patterns, args.field,
+                              key_filters)
     else:
         hits = search_headers(patterns, fasta_file, args.invert_match, color,
-                              args.max_count)
+                              args.max_count, args.all_patterns, args.field,
+                              key_filters)
 
     if args.output_sequences and not args.output_headers:
         output_seqs(hits, args.line_number, color)
@@ -765,6 +2150,14 @@ def main():
 
 
 def entry():
+    '''
+    Console script entry point. Answers a lone version request without
+    building the argument parser, otherwise runs the program.
+    '''
+    if sys.argv[1:] in (['-V'], ['--version']):
+        print(VERSION_NUMBER)
+        return 0
+
     main()
     return 0
 
@@ -0,0 +1,39 @@
+'Fixtures shared by the bfg tests.'
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+SOURCE = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'src')
+# Runs the console script entry point from the source tree
+ENTRY = ('import sys; sys.path.insert(0, {!r}); sys.argv[0] = "bfg"; '
+         'from better_fasta_grep.bfg import entry; entry()'.format(SOURCE))
+
+
+@pytest.fixture
+def run_bfg():
+    '''
+    Returns a function that runs bfg, with empty standard input, on the
+    given arguments, after any given options to the interpreter. The
+    function returns the completed process.
+    '''
+    def run(*arguments, python_options=()):
+        return subprocess.run(
+            [sys.executable] + list(python_options) + ['-c', ENTRY] +
+            list(arguments), stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            universal_newlines=True)
+    return run
+
+
+@pytest.fixture
+def write_file(tmp_path):
+    'Returns a function that writes a text file and returns its path.'
+    def write(name, text):
+        path = tmp_path / name
+        path.write_text(text)
+        return str(path)
+    return write
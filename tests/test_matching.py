@@ -0,0 +1,70 @@
+'Tests of how records are selected by one or more patterns.'
+
+import pytest
+
+from better_fasta_grep import bfg
+
+FASTA = ('junk before the first header\n'
+         '>seq1 HUMAN\nACGT\n'
+         '>seq2 MOUSE\nGGCC\n'
+         '>seq3 HUMAN MOUSE\nACCA\n'
+         '>seq4 RAT\nTTTT\n')
+
+
+@pytest.fixture
+def count(run_bfg, write_file):
+    '''
+    Returns a function that runs bfg -c with the given arguments on FASTA and
+    returns the printed count.
+    '''
+    fasta = write_file('test.fa', FASTA)
+
+    def run(*arguments):
+        result = run_bfg('-c', *(arguments + (fasta,)))
+        assert result.returncode == 0, result.stderr
+        return int(result.stdout)
+    return run
+
+
+@pytest.mark.parametrize('string, invert_match, match_all, expected', [
+    ('HUMAN', False, False, True),
+    ('HUMAN', True, False, False),
+    ('HUMAN', False, True, False),
+    ('HUMAN', True, True, True),
+    ('HUMAN MOUSE', False, True, True),
+    ('HUMAN MOUSE', True, True, False),
+    ('RAT', False, False, False),
+    ('RAT', True, False, True),
+])
+def test_match_patterns(string, invert_match, match_all, expected):
+    patterns = bfg.PatternPlan([bfg.add_pattern('HUMAN'),
+                                bfg.add_pattern('MOUSE')])
+
+    assert bfg.match_patterns(patterns, string, invert_match=invert_match,
+                              match_all=match_all) is expected
+
+
+def test_empty_plan_selects_nothing():
+    assert not bfg.match_patterns(bfg.PatternPlan(), 'HUMAN')
+
+
+@pytest.mark.parametrize('arguments, expected', [
+    (['HUMAN'], 2),
+    (['-v', 'HUMAN'], 2),
+    (['-v', 'MOUSE'], 2),
+    (['-v', 'seq'], 0),
+    (['--search-sequences', '-v', 'AC'], 2),
+    (['--search-records', '.'], 4),
+    (['--search-sequences', '.'], 4),
+])
+def test_count(count, arguments, expected):
+    assert count(*arguments) == expected
+
+
+def test_count_all_patterns(count, write_file):
+    patterns = write_file('patterns.txt', 'HUMAN\nMOUSE\n')
+
+    assert count('-f', patterns) == 3
+    assert count('--all-patterns', '-f', patterns) == 1
+    assert count('-v', '--all-patterns', '-f', patterns) == 3
+    assert count('-v', '--any-pattern', '-f', patterns) == 1
@@ -0,0 +1,82 @@
+'Tests of PatternPlan, which orders patterns and prefilters them by literals.'
+
+import random
+
+import pytest
+
+from better_fasta_grep import bfg
+
+PATTERNS = ['HUMAN', 'MOUSE', 'AB+C', r'A\.B', 'A.B', 'AC?GT', 'GAT{2}',
+            'T[AC]A', 'seq[0-9]', 'N', 'A|G', r'\bAB', '(AC)+G', 'x*']
+
+
+@pytest.mark.parametrize('string, expected', [
+    ('ACGT', ('ACGT', True)),
+    ('AB+C', ('AB', False)),
+    (r'A\.B', ('A.B', True)),
+    ('A.B', ('A', False)),
+    ('AB*C', ('A', False)),
+    ('AB?', ('A', False)),
+    ('AB{2}', ('A', False)),
+    ('A|B', ('', False)),
+    (r'\dA', ('', False)),
+    ('(AB)', ('', False)),
+    ('', ('', True)),
+])
+def test_literal_prefix(string, expected):
+    assert bfg.literal_prefix(bfg.add_pattern(string)) == expected
+
+
+def test_duplicates_are_dropped():
+    plan = bfg.PatternPlan([bfg.add_pattern('HUMAN'),
+                            bfg.add_pattern('HUMAN'),
+                            bfg.add_pattern('HUMAN', fixed_strings=True),
+                            bfg.add_pattern('human', ignore_case=True),
+                            bfg.add_pattern('HUMAN', ignore_case=True)])
+    assert len(plan) == 2
+
+
+def test_escaped_literal_is_not_merged_with_regex():
+    escaped = bfg.add_pattern(r'A\.B')
+    regex = bfg.add_pattern('A.B')
+    plan = bfg.PatternPlan([escaped, regex])
+
+    assert set(plan) == {escaped, regex}
+    assert bfg.match_patterns(plan, 'AxB')
+    assert not bfg.match_patterns(bfg.PatternPlan([escaped]), 'AxB')
+
+
+def random_strings(rng, count):
+    'Returns a list of count random strings.'
+    return [''.join(rng.choice('ABCGNTx.') for _ in range(rng.randint(0, 12)))
+            for _ in range(count)] + ['seq1 HUMAN', 'MOUSE', 'GATTACA']
+
+
+@pytest.mark.parametrize('ignore_case', [False, True])
+@pytest.mark.parametrize('match_all', [False, True])
+@pytest.mark.parametrize('seed', range(5))
+def test_plan_agrees_with_search(seed, match_all, ignore_case):
+    rng = random.Random(seed)
+    patterns = [bfg.add_pattern(string, ignore_case)
+                for string in rng.sample(PATTERNS, rng.randint(1, 5))]
+    plan = bfg.PatternPlan(patterns)
+    check = all if match_all else any
+
+    # enough strings for the plan to be reordered by its hit counts
+    for string in random_strings(rng, 3 * bfg.REORDER_INTERVAL):
+        expected = check(pattern.search(string) for pattern in patterns)
+        assert plan.matches((string,), match_all) is expected
+
+
+def test_cache_is_shared_between_plans():
+    human, mouse = bfg.add_pattern('HUMAN'), bfg.add_pattern('MOUSE')
+    cache = {}
+
+    assert bfg.PatternPlan([human]).matches(('seq1 HUMAN',), cache=cache)
+    assert cache == {human: True}
+
+    # the cached result is used, not searched again
+    cache[human] = False
+    assert not bfg.PatternPlan([mouse, human]).matches(('seq1 HUMAN',),
+                                                       cache=cache)
+    assert cache == {human: False, mouse: False}
@@ -0,0 +1,120 @@
+'Tests of --queries, which runs many named queries in one pass.'
+
+import pytest
+
+from better_fasta_grep import bfg
+
+FASTA = ('>seq1 HUMAN OS=Homo sapiens\nACGT\n'
+         '>seq2 MOUSE OS=Mus musculus\nGGCC\n')
+
+RECORDS = ('>seq1 HUMAN OX=9606\nACGT\n'
+           '>seq2 MOUSE OX=10090\nGGCC\n'
+           '>seq3 HUMAN MOUSE OX=9606\nACCA\n'
+           '>seq4 empty OX=9606\n'
+           '>seq5 RAT OX=10116\nTTAC\nGT\n'
+           '>seq6 HUMAN OX=9606\nGATTACA\n')
+
+PATTERNS = [['HUMAN'], ['HUMAN', 'MOUSE'], ['AC'], ['AC', 'GT'], ['XYZ']]
+# Patterns with groups, which can not be combined into the union pattern of
+# their mode
+GROUPED_PATTERNS = [['(HU)MAN', 'seq[36]'], ['(A)C', 'T{2}']]
+
+
+def single_count(patterns, mode, file, invert_match, max_count, match_all,
+                 key_filters):
+    'Returns the count of a single search in the given mode.'
+    if mode == 'sequences':
+        return bfg.count_seq_matches(patterns, file, invert_match, max_count,
+                                     match_all, key_filters)
+    if mode == 'records':
+        return bfg.count_record_matches(patterns, file, invert_match,
+                                        max_count, match_all, None,
+                                        key_filters)
+    return bfg.count_header_matches(patterns, file, invert_match, max_count,
+                                    match_all, None, key_filters)
+
+
+@pytest.fixture
+def fasta(write_file):
+    return write_file('test.fa', FASTA)
+
+
+def test_invalid_pattern_names_file_and_line(run_bfg, write_file, fasta):
+    queries = write_file('queries.tsv', '# comment\nhuman\tHUMAN\nbad\t(\n')
+
+    result = run_bfg('--queries', queries, fasta)
+
+    assert result.returncode != 0
+    assert 'bfg: error: {}, line 3: '.format(queries) in result.stderr
+    assert 'Traceback' not in result.stderr
+
+
+def test_missing_queries_file(run_bfg, tmp_path, fasta):
+    result = run_bfg('--queries', str(tmp_path / 'missing.tsv'), fasta)
+
+    assert result.returncode != 0
+    assert result.stderr.startswith('bfg: error: ')
+
+
+def test_queries_without_fasta_file(monkeypatch, write_file):
+    queries = write_file('queries.tsv', 'human\tHUMAN\n')
+    monkeypatch.setattr(bfg, 'stdin_has_data', lambda: False)
+    monkeypatch.setattr('sys.argv', ['bfg', '--queries', queries])
+
+    with pytest.raises(SystemExit) as error:
+        bfg.main()
+
+    assert str(error.value).startswith('bfg: error: --queries needs')
+
+
+def test_field_with_sequences_query(run_bfg, write_file, fasta):
+    queries = write_file('queries.tsv', 'human\tHUMAN\nac\tAC\tsequences\n')
+
+    result = run_bfg('--field', 'OS', '--queries', queries, fasta)
+
+    assert result.returncode != 0
+    assert 'sequences mode' in result.stderr
+
+
+def test_field_with_header_queries(run_bfg, write_file, fasta):
+    queries = write_file('queries.tsv', 'homo\tHomo\nmouse\tMOUSE\n')
+
+    result = run_bfg('-c', '--field', 'OS', '--queries', queries, fasta)
+
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.split() == ['homo:1', 'mouse:0']
+
+
+@pytest.mark.parametrize('key_filters', [None, {'OX': {'9606'}}])
+@pytest.mark.parametrize('max_count', [None, 1])
+@pytest.mark.parametrize('match_all', [False, True])
+@pytest.mark.parametrize('invert_match', [False, True])
+@pytest.mark.parametrize('groups', [False, True])
+def test_count_queries_agrees_with_single_counts(
+        write_file, groups, invert_match, match_all, max_count, key_filters):
+    fasta = write_file('records.fa', RECORDS)
+    strings = PATTERNS + GROUPED_PATTERNS if groups else PATTERNS
+    queries = [('{}{}'.format(mode, number),
+                bfg.PatternPlan([bfg.add_pattern(string)
+                                 for string in query_strings]), mode)
+               for mode in bfg.QUERY_MODES
+               for number, query_strings in enumerate(strings)]
+
+    hit_counts = bfg.count_queries(queries, fasta, invert_match, max_count,
+                                   match_all, None, key_filters)
+
+    assert hit_counts == {
+        name: single_count(patterns, mode, fasta, invert_match, max_count,
+                           match_all, key_filters)
+        for name, patterns, mode in queries}
+
+
+def test_union_pattern():
+    union = bfg.union_pattern(bfg.add_pattern(string)
+                              for strings in PATTERNS for string in strings)
+    assert union.search('xMOUSEx') and not union.search('RAT')
+
+    assert bfg.union_pattern(bfg.add_pattern(string)
+                             for strings in GROUPED_PATTERNS
+                             for string in strings) is None
+    assert bfg.union_pattern([]) is None
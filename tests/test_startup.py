@@ -0,0 +1,39 @@
+'Checks which modules bfg imports at startup, with python -X importtime.'
+
+import pytest
+
+FASTA = '>seq1 HUMAN\nACGT\n>seq2 MOUSE\nGGCC\n'
+
+
+@pytest.fixture
+def imported_modules(run_bfg):
+    '''
+    Returns a function that runs bfg with the given arguments and returns the
+    set of modules imported during the run, as reported by -X importtime.
+    '''
+    def imported(*arguments):
+        result = run_bfg(*arguments, python_options=['-X', 'importtime'])
+        assert result.returncode == 0
+        return {line.split('|')[-1].strip()
+                for line in result.stderr.splitlines()
+                if line.startswith('import time:')}
+    return imported
+
+
+@pytest.fixture
+def fasta(write_file):
+    return write_file('test.fa', FASTA)
+
+
+def test_version_imports_neither_argparse_nor_re(imported_modules):
+    modules = imported_modules('--version')
+    assert 'argparse' not in modules
+    assert 're' not in modules
+
+
+def test_plain_search_skips_argparse(imported_modules, fasta):
+    assert 'argparse' not in imported_modules('HUMAN', fasta)
+
+
+def test_options_use_argparse(imported_modules, fasta):
+    assert 'argparse' in imported_modules('-c', 'HUMAN', fasta)
@@ -0,0 +1,106 @@
+'Tests of the record table behind --sort-by, --sample and --record-table.'
+
+import os
+
+import pytest
+
+from better_fasta_grep import bfg
+
+FASTA = ('junk before the first header\n'
+         '>seq1 HUMAN OS=Homo sapiens\nACGTAC\nGT\n'
+         '>seq2 MOUSE OS=Mus musculus\nGGCC\n'
+         '>seq3 empty HUMAN\n'
+         '>seq4 HUMAN MOUSE\nACCA\nTTAC\nA\n'
+         '>seq5 RAT\nTTTT\n')
+
+SEARCHES = {'headers': bfg.search_headers,
+            'sequences': bfg.search_sequences,
+            'records': bfg.search_records}
+
+
+@pytest.fixture(params=['\n', '\r\n'], ids=['lf', 'crlf'])
+def fasta(request, tmp_path):
+    'Writes FASTA, with either line ending, and returns its path.'
+    path = tmp_path / 'test.fa'
+    path.write_bytes(FASTA.replace('\n', request.param).encode())
+    return str(path)
+
+
+def columns(table):
+    'Returns the columns of a table as a dictionary of lists.'
+    return {name: list(getattr(table, name))
+            for name, _ in bfg.TABLE_COLUMNS}
+
+
+def test_read_agrees_with_sequence_records(fasta):
+    table = bfg.build_record_table(fasta)
+
+    with open(fasta, 'rb') as file:
+        records = [table.read(file, index) for index in range(len(table))]
+        sequences = [table.read_sequence(file, index)
+                     for index in range(len(table))]
+
+    expected = list(bfg.sequence_records(fasta, include_empty=True))
+    assert records == expected
+    assert sequences == [record[2] for record in expected]
+    assert list(table.lengths) == [len(record[2]) for record in expected]
+
+
+def test_save_and_load(fasta, tmp_path):
+    table_path = str(tmp_path / 'test.table')
+    table = bfg.build_record_table(fasta)
+    table.save(table_path)
+
+    loaded = bfg.RecordTable.load(table_path, fasta)
+
+    assert (loaded.size, loaded.mtime) == (table.size, table.mtime)
+    assert columns(loaded) == columns(table)
+
+
+@pytest.mark.parametrize('change', ['size', 'mtime'])
+def test_stale_table_is_rebuilt(fasta, tmp_path, change):
+    table_path = str(tmp_path / 'test.table')
+    bfg.get_record_table(fasta, table_path)
+
+    if change == 'size':
+        with open(fasta, 'ab') as file:
+            file.write(b'>seq6 DOG\nCCCC\n')
+    else:
+        stat = os.stat(fasta)
+        os.utime(fasta, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+    assert bfg.RecordTable.load(table_path, fasta) is None
+    table = bfg.get_record_table(fasta, table_path)
+
+    assert columns(table) == columns(bfg.build_record_table(fasta))
+    assert columns(bfg.RecordTable.load(table_path, fasta)) == columns(table)
+
+
+def test_other_files_are_not_overwritten(fasta, tmp_path):
+    other = tmp_path / 'notes.txt'
+    other.write_text('not a table\n')
+
+    with pytest.raises(ValueError):
+        bfg.get_record_table(fasta, str(other))
+    with pytest.raises(ValueError):
+        bfg.get_record_table(fasta, fasta)
+
+    assert other.read_text() == 'not a table\n'
+
+
+@pytest.mark.parametrize('invert_match', [False, True])
+@pytest.mark.parametrize('mode', bfg.QUERY_MODES)
+@pytest.mark.parametrize('pattern', ['HUMAN', 'AC', 'seq', 'XYZ'])
+def test_table_search_agrees_with_stream_search(fasta, mode, pattern,
+                                                invert_match):
+    patterns = bfg.get_patterns(pattern)
+    table = bfg.build_record_table(fasta)
+
+    with open(fasta, 'rb') as file:
+        indices = bfg.select_table_records(table, file, patterns, mode,
+                                           invert_match)
+        hits = list(bfg.search_table(table, file, indices, patterns, mode,
+                                     invert_match))
+
+    expected = SEARCHES[mode](patterns, fasta, invert_match)
+    assert hits == list(expected)
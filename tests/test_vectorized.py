@@ -0,0 +1,40 @@
+'Compares the NumPy engine with the regular expression engine.'
+
+import random
+
+import pytest
+
+from better_fasta_grep import bfg
+
+pytest.importorskip('numpy')
+
+PATTERNS = ['AB+C', 'C.{2,4}C', 'M.+K', 'A+BC', 'AB{2,}', 'A{2}B{1,3}C+',
+            '[AC]{3}', 'A.G', '[^A]{5}', 'T{2,5}C', 'N+G', 'G[A-C]T',
+            'A{1}C{2,}', 'C.{3}C']
+SEQUENCES = ['XABBCX', 'ACAAACA', 'MAAK', 'AAABC', 'ABBB', 'AABBBCC']
+
+
+def random_sequences(count, seed=1):
+    'Returns a list of count random sequences.'
+    rng = random.Random(seed)
+    return [''.join(rng.choice('ABCGKMNT') for _ in range(rng.randint(1, 40)))
+            for _ in range(count)]
+
+
+@pytest.mark.parametrize('ignore_case', [False, True])
+@pytest.mark.parametrize('string', PATTERNS)
+def test_engine_agrees_with_re(monkeypatch, string, ignore_case):
+    monkeypatch.setattr(bfg, 'VECTORIZE_MIN_RECORDS', 1)
+    pattern = bfg.add_pattern(string, ignore_case)
+    patterns = bfg.PatternPlan([pattern])
+    sequences = SEQUENCES + random_sequences(2000)
+
+    selected = bfg.match_sequences(patterns, sequences)
+
+    assert selected == [bool(pattern.search(sequence))
+                        for sequence in sequences]
+
+
+@pytest.mark.parametrize('string', ['AB+C', 'C.{2,4}C', 'M.+K', 'A+B+C+'])
+def test_variable_inner_atom_is_not_vectorized(string):
+    assert bfg.simple_pattern_atoms(bfg.add_pattern(string)) is None